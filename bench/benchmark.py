@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os, sys, io, json, time, threading, contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from net import *
+from config import *
+from terminal import *
+from interface import *
+from layout import *
+from session import *
+from charset import *
+from image import *
+import terminal
+
+from gopherd import StandInServer, generate_text, generate_certificate
+
+
+
+benchmarks = []
+'''
+:list<(str, (StandInServer, int)→dict<str, int|float>)>  Name and function of each benchmark,
+                                                          the function takes the server and
+                                                          the number of repetitions and returns
+                                                          the measurements
+'''
+
+
+def benchmark(name):
+    '''
+    Decorator for registering a benchmark
+    
+    @param   name:str  The name of the benchmark
+    @return  :(¿F?)→¿F?  Function that registers the benchmark and returns it unchanged
+    '''
+    def register(function):
+        benchmarks.append((name, function))
+        return function
+    return register
+
+
+def median(values):
+    '''
+    Get the median of a list of numbers
+    
+    @param   values:list<int|float>  The numbers
+    @return  :int|float              The median
+    '''
+    values = sorted(values)
+    n = len(values)
+    return values[n // 2] if n % 2 == 1 else (values[n // 2 - 1] + values[n // 2]) / 2
+
+
+@contextlib.contextmanager
+def captured_stdout():
+    '''
+    Capture everything printed to stdout
+    
+    @return  :itr<StringIO>  The buffer the output is written to
+    '''
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        yield buf
+
+
+@benchmark('fetch')
+def bench_fetch(server, repeat):
+    '''
+    Measure end-to-end fetch throughput for menus, text items and binaries
+    '''
+    rc = {}
+    for kind, selector in (('menu', '/menu/1000'), ('text', '/text/1024'), ('binary', '/bin/1024')):
+        server.get_item(selector)
+        totals, size = [], 0
+        for _ in range(repeat):
+            metrics = {}
+            for _chunk in fetch(server.host, server.port, selector, metrics):
+                pass
+            totals.append(metrics['total'])
+            size = metrics['bytes']
+        rc['%s_seconds' % kind] = median(totals)
+        rc['%s_bytes_per_second' % kind] = size / median(totals)
+    return rc
+
+
+@benchmark('first_render')
+def bench_first_render(server, repeat):
+    '''
+    Measure the time from the start of a request until the first frame has been drawn
+    '''
+    server.get_item('/text/1024')
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in sanitise_stream(decode_stream(fetch(server.host, server.port, '/text/1024'), server.host)):
+            page = Layout()
+            page.append(text)
+            tabs[:] = [Tab('gopher://127.0.0.1/0/text/1024', page = page)]
+            with captured_stdout():
+                draw_interface(1, 1, 80, 24)
+            times.append(time.perf_counter() - start)
+            break
+    return {'seconds' : median(times)}
+
+
+@benchmark('url')
+def bench_url(server, repeat):
+    '''
+    Measure URL construction and parsing speed
+    '''
+    n = 2000
+    params = {'scheme' : 'gopher', 'domain' : 'gopher.example.org', 'port' : 70, 'item_type' : '1',
+              'path' : '/users/someone/phlog/2015', 'query_string' : 'search=gopher&page=2'}
+    url = construct_url(**params)
+    construct, parse = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            construct_url(**params)
+        construct.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(n):
+            parse_url(url, default_protocol)
+        parse.append(time.perf_counter() - start)
+    return {'construct_per_second' : n / median(construct), 'parse_per_second' : n / median(parse)}
+
+
+@benchmark('input')
+def bench_input(server, repeat):
+    '''
+    Measure terminal input decoding speed
+    '''
+    units = ['a', 'Z', ' ', 'å', 'ゴ', '\033[A', '\033[5~', ctrl('L'), meta('x')] * 2000
+    data = ''.join(units).encode('utf-8')
+    saved_fileno = terminal._terminal_input_fileno
+    times = []
+    try:
+        for _ in range(repeat):
+            (rfd, wfd) = os.pipe()
+            def write():
+                os.write(wfd, data)
+                os.close(wfd)
+            writer = threading.Thread(target = write)
+            writer.start()
+            terminal._terminal_input_fileno = rfd
+            consumed = 0
+            start = time.perf_counter()
+            while consumed < len(data):
+                consumed += len(read_terminal_input().encode('utf-8'))
+            times.append(time.perf_counter() - start)
+            writer.join()
+            os.close(rfd)
+    finally:
+        terminal._terminal_input_fileno = saved_fileno
+    return {'bytes_per_second' : len(data) / median(times)}
+
+
+@benchmark('render')
+def bench_render(server, repeat):
+    '''
+    Measure the number of bytes written per frame and the time it takes to draw a frame
+    '''
+    n = 200
+    rc = {}
+    text = generate_text(64).decode('utf-8')
+    tabs[:] = [Tab('gopher://127.0.0.1/0/text/64', page = Layout(text)), Tab(title = 'Welcome')]
+    for (width, height) in ((80, 24), (200, 60)):
+        times, size = [], 0
+        for _ in range(repeat):
+            with captured_stdout() as buf:
+                start = time.perf_counter()
+                for _ in range(n):
+                    draw_interface(1, 1, width, height)
+                times.append(time.perf_counter() - start)
+            size = len(buf.getvalue().encode('utf-8')) // n
+        rc['bytes_per_frame_%ix%i' % (width, height)] = size
+        rc['seconds_per_frame_%ix%i' % (width, height)] = median(times) / n
+    return rc
+
+
+@benchmark('layout')
+def bench_layout(server, repeat):
+    '''
+    Measure line wrapping speed, and the time it takes to redisplay a large document after a resize
+    '''
+    text = generate_text(4096).decode('utf-8')
+    chars = len(text)
+    wrap, resize = [], []
+    for i in range(repeat):
+        layout = Layout(text)
+        start = time.perf_counter()
+        for line in range(len(layout.lines)):
+            layout.line_wraps(line, 60 + i)
+        wrap.append(time.perf_counter() - start)
+        middle = len(layout.lines) // 2
+        start = time.perf_counter()
+        for width in range(80, 160, 8):
+            layout.rows(width, *layout.scroll(width, middle, 0, 0), 60)
+        resize.append((time.perf_counter() - start) / 10)
+    return {'wrap_chars_per_second' : chars / median(wrap), 'resize_seconds' : median(resize)}
+
+
+@benchmark('decode')
+def bench_decode(server, repeat):
+    '''
+    Measure the speed and peak memory use of decoding text items into the line index
+    '''
+    import tracemalloc
+    rc = {}
+    for charset in ('utf-8', 'latin-1', 'cp437'):
+        data = generate_text(4096, 0, charset)
+        chunks = [data[i : i + 4096] for i in range(0, len(data), 4096)]
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            page = Layout()
+            for text in sanitise_stream(decode_stream(chunks)):
+                page.append(text)
+            times.append(time.perf_counter() - start)
+        rc['%s_bytes_per_second' % charset] = len(data) / median(times)
+    tracemalloc.start()
+    page = Layout()
+    for text in sanitise_stream(decode_stream(chunks)):
+        page.append(text)
+    rc['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rc
+
+
+@benchmark('image')
+def bench_image(server, repeat):
+    '''
+    Measure time spent in the interface, and the latency, when fetching and rendering images in worker processes
+    '''
+    try:
+        from PIL import Image
+    except ImportError:
+        return {}
+    import select
+    image = Image.new('RGB', (640, 480))
+    image.putdata([(x % 256, y % 256, (x * y) % 256) for y in range(480) for x in range(640)])
+    buf = io.BytesIO()
+    image.save(buf, 'PNG')
+    with server.items_lock:
+        server.items['/image.png'] = buf.getvalue()
+    url = 'gopher://%s:%i/p/image.png' % (server.host, server.port)
+    renderer = ImageRenderer(workers = 2, cache_size = 64)
+    try:
+        renderer.get(url, 8, 4)
+        while renderer.get(url, 8, 4) is None:
+            select.select([renderer.wakeup_fd], [], [])
+            renderer.poll()
+        ui, latency = [], []
+        for i in range(repeat):
+            start = time.perf_counter()
+            renderer.get(url, 80 + i, 24)
+            ui_time = time.perf_counter() - start
+            while True:
+                select.select([renderer.wakeup_fd], [], [])
+                start_poll = time.perf_counter()
+                renderer.poll()
+                lines = renderer.get(url, 80 + i, 24)
+                ui_time += time.perf_counter() - start_poll
+                if lines is not None:
+                    break
+            latency.append(time.perf_counter() - start)
+            ui.append(ui_time)
+    finally:
+        renderer.close()
+    return {'ui_seconds_per_frame' : median(ui), 'frame_latency_seconds' : median(latency)}
+
+
+@benchmark('tls')
+def bench_tls(server, repeat):
+    '''
+    Measure TLS handshake time for new and for resumed sessions, against a server with a self-signed
+    certificate, and check that the item is received intact, that the session is resumed, and that
+    the certificate is rejected unless it is trusted
+    '''
+    import ssl, shutil, tempfile
+    if shutil.which('openssl') is None:
+        return {}
+    with tempfile.TemporaryDirectory() as directory:
+        (cert, key) = generate_certificate(directory, server.host)
+        server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        server_context.load_cert_chain(cert, key)
+        with open(cert, 'r') as file:
+            cert = file.read()
+    with StandInServer(server.latency, server.bandwidth, server.host, tls_context = server_context) as tls_server:
+        item = tls_server.get_item('/text/64')
+        try:
+            b''.join(fetch(tls_server.host, tls_server.port, '/text/64', tls = True, context = ssl.create_default_context()))
+        except ssl.SSLCertVerificationError:
+            pass
+        else:
+            raise AssertionError('untrusted self-signed certificate was accepted')
+        full, resumed = [], []
+        for _ in range(repeat):
+            context = ssl.create_default_context(cadata = cert)
+            for handshakes, session_reused in ((full, False), (resumed, True)):
+                metrics = {}
+                body = b''.join(fetch(tls_server.host, tls_server.port, '/text/64', metrics, tls = True, context = context))
+                assert body == item, 'item was not received intact over TLS'
+                assert metrics['session_reused'] == session_reused, 'TLS session resumption %s' % \
+                    ('failed' if session_reused else 'without an earlier session')
+                handshakes.append(metrics['handshake'] - metrics['connect'])
+    return {'full_handshake_seconds' : median(full), 'resumed_handshake_seconds' : median(resumed)}
+
+
+@benchmark('session')
+def bench_session(server, repeat):
+    '''
+    Measure the time it takes to restore a session with one tab and with 100 tabs
+    '''
+    import tempfile
+    rc = {}
+    with tempfile.TemporaryDirectory() as directory:
+        spill_store = SpillStore(os.path.join(directory, 'store'))
+        for count in (1, 100):
+            path = os.path.join(directory, 'session-%i' % count)
+            tabs = []
+            for i in range(count):
+                raw = generate_text(256, i)
+                tabs.append(Tab('gopher://127.0.0.1/0/text/%i' % i, raw = raw, page = Layout(raw.decode('utf-8'))))
+            start = time.perf_counter()
+            save_session(tabs, 0, spill_store, path)
+            rc['save_%i_tabs_seconds' % count] = time.perf_counter() - start
+            times = []
+            for _ in range(repeat):
+                # As a new instance, which links the content into a directory of its own
+                restore_store = SpillStore(os.path.join(directory, 'store'))
+                start = time.perf_counter()
+                load_session(restore_store, path)
+                times.append(time.perf_counter() - start)
+            rc['restore_%i_tabs_seconds' % count] = median(times)
+        # save_session has already stored every tab, so start
+        # over with a new store to measure compression and writing
+        spill_store = SpillStore(os.path.join(directory, 'spill'))
+        for tab in tabs:
+            tab.store_key = None
+        start = time.perf_counter()
+        for tab in tabs[1:]:
+            tab.spill(spill_store)
+        rc['spill_seconds_per_tab'] = (time.perf_counter() - start) / (len(tabs) - 1)
+        start = time.perf_counter()
+        for tab in tabs[1:]:
+            tab.materialise(spill_store)
+        rc['materialise_seconds_per_tab'] = (time.perf_counter() - start) / (len(tabs) - 1)
+    return rc
+
+
+def get_commit():
+    '''
+    Get the current git commit
+    
+    @return  :str?  The ID of the checked out commit, `None` if not available
+    '''
+    from subprocess import Popen, PIPE
+    try:
+        proc = Popen(['git', 'rev-parse', 'HEAD'], stdout = PIPE, stderr = PIPE,
+                     cwd = os.path.dirname(os.path.abspath(__file__)))
+        out = proc.communicate()[0].decode('utf-8', 'replace').strip()
+        return out if proc.returncode == 0 else None
+    except OSError:
+        return None
+
+
+def run(names = None, repeat = 5, latency = 0, bandwidth = None):
+    '''
+    Run benchmarks
+    
+    @param   names:list<str>?  The benchmarks to run, `None` for all
+    @param   repeat:int        The number of times to repeat each measurement
+    @param   latency:float     The response latency of the stand-in server, in seconds
+    @param   bandwidth:int?    The bandwidth of the stand-in server, in bytes per second
+    @return  :dict<str, ¿V?>   The results
+    '''
+    results = {}
+    with StandInServer(latency, bandwidth) as server:
+        for name, function in benchmarks:
+            if names is None or name in names:
+                results[name] = function(server, repeat)
+    return {'commit' : get_commit(), 'time' : time.time(), 'python' : sys.version.split()[0],
+            'repeat' : repeat, 'latency' : latency, 'bandwidth' : bandwidth, 'results' : results}
+
+
+def compare(old, new):
+    '''
+    Print a comparison between two benchmark runs
+    
+    @param  old:dict<str, ¿V?>  The results of the reference run
+    @param  new:dict<str, ¿V?>  The results of the new run
+    '''
+    print('%-24s %-32s %14s %14s %8s' % ('benchmark', 'measurement', 'old', 'new', 'ratio'))
+    for name in new['results']:
+        for key, value in new['results'][name].items():
+            prev = old['results'].get(name, {}).get(key, None)
+            ratio = '%8.3f' % (value / prev) if prev else '%8s' % '-'
+            prev = '%14.6g' % prev if prev is not None else '%14s' % '-'
+            print('%-24s %-32s %s %14.6g %s' % (name, key, prev, value, ratio))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description = 'Benchmark gopher-love against a local stand-in server')
+    parser.add_argument('names', nargs = '*', help = 'benchmarks to run, all if none are specified')
+    parser.add_argument('-o', '--output', help = 'write the results, as JSON, to this file')
+    parser.add_argument('-c', '--compare', help = 'compare against results from an earlier run')
+    parser.add_argument('-r', '--repeat', type = int, default = 5, help = 'number of repetitions')
+    parser.add_argument('-l', '--latency', type = float, default = 0, help = 'server latency in seconds')
+    parser.add_argument('-b', '--bandwidth', type = int, default = None, help = 'server bandwidth in bytes per second')
+    args = parser.parse_args()
+    
+    results = run(args.names or None, args.repeat, args.latency, args.bandwidth)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent = 2)
+            file.write('\n')
+    if args.compare is not None:
+        with open(args.compare, 'r') as file:
+            compare(json.load(file), results)
+    elif args.output is None:
+        json.dump(results, sys.stdout, indent = 2)
+        print()
@@ -0,0 +1,293 @@
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import random, socketserver, threading, time
+
+
+
+def generate_menu(host, port, items, seed = 0):
+    '''
+    Generate a gopher menu
+    
+    @param   host:str    The host the menu entries shall point to
+    @param   port:int    The port the menu entries shall point to
+    @param   items:int   The number of entries in the menu
+    @param   seed:int    Seed for the random number generator
+    @return  :bytes      The menu
+    '''
+    rand = random.Random(seed)
+    types = '0019iiih'
+    buf = []
+    for i in range(items):
+        item_type = rand.choice(types)
+        if item_type == 'i':
+            buf.append('i%s\t\terror.host\t1\r\n' % generate_line(rand, 60))
+        elif item_type == '1':
+            buf.append('1Directory %i\t/menu/%i\t%s\t%i\r\n' % (i, rand.randrange(10, 500), host, port))
+        elif item_type == '9':
+            buf.append('9Binary %i\t/bin/%i\t%s\t%i\r\n' % (i, rand.randrange(1, 256), host, port))
+        elif item_type == 'h':
+            buf.append('hWeb page %i\tURL:http://example.org/%i\t%s\t%i\r\n' % (i, i, host, port))
+        else:
+            buf.append('0Document %i\t/text/%i\t%s\t%i\r\n' % (i, rand.randrange(1, 256), host, port))
+    buf.append('.\r\n')
+    return ''.join(buf).encode('utf-8')
+
+
+def generate_line(rand, width):
+    '''
+    Generate a line of text
+    
+    @param   rand:Random  The random number generator to use
+    @param   width:int    The approximate length of the line
+    @return  :str         The line, without line break
+    '''
+    words = ('gopher', 'hole', 'menu', 'selector', 'phlog', 'burrow', 'café', 'naïve',
+             'the', 'a', 'of', 'and', 'in', 'text', 'item', 'server', 'client', 'ゴーファー', 'Gänsefüßchen')
+    line = rand.choice(words)
+    while len(line) < width:
+        line += ' ' + rand.choice(words)
+    return line
+
+
+def generate_text(kibibytes, seed = 0, charset = 'utf-8'):
+    '''
+    Generate a gopher text item
+    
+    @param   kibibytes:int  The approximate size of the item, in kibibytes
+    @param   seed:int       Seed for the random number generator
+    @param   charset:str    The character encoding of the item, characters
+                            that cannot be encoded are replaced
+    @return  :bytes         The text item
+    '''
+    rand = random.Random(seed)
+    buf, size = [], 0
+    while size < kibibytes * 1024:
+        line = (generate_line(rand, rand.randrange(0, 100)) + '\r\n').encode(charset, 'replace')
+        if line.startswith(b'.'):
+            line = b'.' + line
+        buf.append(line)
+        size += len(line)
+    buf.append(b'.\r\n')
+    return b''.join(buf)
+
+
+def generate_binary(kibibytes, seed = 0):
+    '''
+    Generate a binary item
+    
+    @param   kibibytes:int  The size of the item, in kibibytes
+    @param   seed:int       Seed for the random number generator
+    @return  :bytes         The binary item
+    '''
+    rand = random.Random(seed)
+    return bytes(rand.getrandbits(8) for _ in range(kibibytes * 1024))
+
+
+def generate_certificate(directory, host = '127.0.0.1'):
+    '''
+    Generate a self-signed certificate using `openssl`
+    
+    @param   directory:str         The directory to store the certificate and key in
+    @param   host:str              The address the certificate shall be valid for
+    @return  :(cert:str, key:str)  The pathnames of the certificate and the key, in PEM format
+    '''
+    import os
+    from subprocess import check_call, DEVNULL
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    san = ('IP:' if host.replace('.', '').isdigit() or ':' in host else 'DNS:') + host
+    check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                '-keyout', key, '-out', cert, '-subj', '/CN=' + host, '-addext', 'subjectAltName=' + san],
+               stdout = DEVNULL, stderr = DEVNULL)
+    return (cert, key)
+
+
+class StandInServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    Local gopher server serving generated content
+    
+    The following selectors are recognised, where `N` is a number:
+    
+        /menu/N  A menu with N entries
+        /text/N  A text item of about N kibibytes
+        /text/N/CHARSET
+                 A text item of about N kibibytes encoded in CHARSET
+        /bin/N   A binary item of N kibibytes
+    
+    Any other selector yields a menu with 20 entries.
+    Generated items are cached so they are only generated once.
+    If a TLS context is specified, the server speaks gopher over TLS.
+    '''
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, latency = 0, bandwidth = None, host = '127.0.0.1', port = 0, tls_context = None):
+        '''
+        Constructor
+        
+        @param  latency:float    The number of seconds to wait before responding
+        @param  bandwidth:int?   The maximum number of bytes sent per second,
+                                 for each connection, `None` for unlimited
+        @param  host:str         The address to bind to
+        @param  port:int         The port to bind to, 0 to select any free port
+        @param  tls_context:SSLContext?
+                                 Server-side TLS context, `None` to not use TLS
+        '''
+        self.latency = latency
+        self.tls_context = tls_context
+        self.bandwidth = bandwidth
+        self.items = {}
+        self.items_lock = threading.Lock()
+        self.thread = None
+        socketserver.TCPServer.__init__(self, (host, port), StandInHandler)
+    
+    
+    @property
+    def host(self):
+        '''
+        :str  The address the server is bound to
+        '''
+        return self.server_address[0]
+    
+    
+    @property
+    def port(self):
+        '''
+        :int  The port the server is bound to
+        '''
+        return self.server_address[1]
+    
+    
+    def get_request(self):
+        '''
+        Accept a connection, the TLS handshake is performed by the handler thread
+        
+        @return  :(socket, ¿A?)  The connection and the address of the client
+        '''
+        (sock, address) = socketserver.TCPServer.get_request(self)
+        if self.tls_context is not None:
+            sock = self.tls_context.wrap_socket(sock, server_side = True, do_handshake_on_connect = False)
+        return (sock, address)
+    
+    
+    def handle_error(self, request, client_address):
+        '''
+        Report an error that occurred while serving a request
+        
+        Failed TLS handshakes are not reported, as they
+        are expected when clients reject the certificate
+        
+        @param  request:socket      The connection
+        @param  client_address:¿A?  The address of the client
+        '''
+        import ssl, sys
+        if not isinstance(sys.exc_info()[1], ssl.SSLError):
+            socketserver.TCPServer.handle_error(self, request, client_address)
+    
+    
+    def get_item(self, selector):
+        '''
+        Get the content of an item
+        
+        @param   selector:str  The selector of the item
+        @return  :bytes        The content of the item
+        '''
+        with self.items_lock:
+            if selector not in self.items:
+                parts = selector.strip('/').split('/')
+                try:
+                    size = int(parts[1]) if len(parts) >= 2 else 20
+                except ValueError:
+                    size = 20
+                if parts[0] == 'text':
+                    charset = parts[2] if len(parts) == 3 else 'utf-8'
+                    self.items[selector] = generate_text(size, size, charset)
+                elif parts[0] == 'bin':
+                    self.items[selector] = generate_binary(size, size)
+                else:
+                    self.items[selector] = generate_menu(self.host, self.port, size, size)
+            return self.items[selector]
+    
+    
+    def start(self):
+        '''
+        Start serving in a background thread
+        
+        @return  :StandInServer  `self`
+        '''
+        self.thread = threading.Thread(target = self.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+    
+    
+    def stop(self):
+        '''
+        Stop serving and close the socket
+        '''
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server_close()
+    
+    
+    def __enter__(self):
+        return self.start()
+    
+    
+    def __exit__(self, *_exc):
+        self.stop()
+
+
+class StandInHandler(socketserver.StreamRequestHandler):
+    '''
+    Request handler for `StandInServer`
+    '''
+    
+    def handle(self):
+        '''
+        Serve one request
+        '''
+        selector = self.rfile.readline().rstrip(b'\r\n').decode('utf-8', 'replace')
+        content = self.server.get_item(selector)
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        bandwidth = self.server.bandwidth
+        if bandwidth is None:
+            self.wfile.write(content)
+            return
+        slice_size = max(bandwidth // 100, 1)
+        start = time.perf_counter()
+        for offset in range(0, len(content), slice_size):
+            self.wfile.write(content[offset : offset + slice_size])
+            ahead = (offset + slice_size) / bandwidth - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7070
+    with StandInServer(port = port) as server:
+        print('Serving on gopher://%s:%i/' % (server.host, server.port))
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
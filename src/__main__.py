@@ -61,8 +61,15 @@ setproctitle(sys.argv[0])
 def main():
     '''
     This function is called directly after the rc-file has been loaded
+    
+    Settings assigned in the rc-file are only assigned in this module,
+    so they are copied into `config`, where the other modules read them
     '''
-    start_interface()
+    import config
+    for name in dir(config):
+        if not name.startswith('_') and name in globals():
+            setattr(config, name, globals()[name])
+    start_interface(open_addresses)
 
 
 ## Read command line arguments
@@ -104,10 +111,9 @@ config_opts = parser.files
 :list<str>  Options passed to the configuration script
 '''
 
-a = lambda opt : opt[0] if opt is not None else []
-open_addresses = a(parser.opts['--open'])
+open_addresses = parser.opts['--open'] or []
 '''
-:list<str>  Addresses to open
+:list<str>  Addresses to open, in the order they were specified
 '''
 
 
@@ -0,0 +1,139 @@
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import codecs, re
+
+import config
+from config import *
+
+
+
+_control_characters = {c : '^' + chr(c + 64) for c in range(0x20) if chr(c) not in '\t\n\r'}
+_control_characters[0x7F] = '^?'
+_control_characters.update({c : '\ufffd' for c in range(0x80, 0xA0)})
+'''
+:dict<int, str>  Map from control characters, other than tab, line feed and carriage return,
+                 to what they are displayed as: caret notation for C0 controls and DEL,
+                 and U+FFFD for C1 controls
+'''
+
+_control_pattern = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
+'''
+:Pattern  Regular expression matching the characters in `_control_characters`
+'''
+
+
+_box_drawing_pattern = re.compile(b'[\xb0-\xdf]{3,}')
+'''
+:Pattern  Regular expression matching runs of bytes that are line drawing characters in CP437
+'''
+
+
+def sniff_charset(data, host = None):
+    '''
+    Guess the character encoding of a text
+    
+    UTF-8 is selected if the text is valid UTF-8, otherwise CP437 is
+    selected if at least half of the non-ASCII bytes are in runs of
+    line drawing characters, and otherwise Windows-1252 is selected.
+    Windows-1252 is used rather than Latin-1 because text labelled
+    Latin-1 often contains its quotation marks and dashes, and it
+    is otherwise the same as Latin-1 for printable characters
+    
+    @param   data:bytes  The beginning of the text
+    @param   host:str?   The host the text was fetched from, used to look
+                         up the encoding in `charset_overrides`
+    @return  :str        The name of the character encoding
+    '''
+    if host is not None and host.lower() in config.charset_overrides:
+        return config.charset_overrides[host.lower()]
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data, False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    high = sum(1 for byte in data if byte >= 0x80)
+    boxes = sum(len(run) for run in _box_drawing_pattern.findall(data))
+    return 'cp437' if boxes > 0 and boxes * 2 >= high else 'cp1252'
+
+
+def decode_stream(chunks, host = None, charset = None):
+    '''
+    Decode a text chunk by chunk
+    
+    The character encoding is guessed from the first `charset_sniff_size`
+    bytes, the rest is decoded as it arrives. Characters split between
+    two chunks are decoded correctly, and invalid byte sequences are
+    replaced with U+FFFD
+    
+    @param   chunks:itr<bytes>  The text, chunk by chunk
+    @param   host:str?          The host the text was fetched from
+    @param   charset:str?       The character encoding, `None` to guess it
+    @return  :itr<str>          The decoded text, chunk by chunk
+    '''
+    decoder, buf, size = None, [], 0
+    if charset is not None:
+        decoder = codecs.getincrementaldecoder(charset)('replace')
+    for chunk in chunks:
+        if decoder is None:
+            buf.append(chunk)
+            size += len(chunk)
+            if size < config.charset_sniff_size:
+                continue
+            chunk, buf = b''.join(buf), None
+            decoder = codecs.getincrementaldecoder(sniff_charset(chunk[:config.charset_sniff_size], host))('replace')
+        text = decoder.decode(chunk, False)
+        if len(text) > 0:
+            yield text
+    if decoder is None:
+        chunk = b''.join(buf)
+        decoder = codecs.getincrementaldecoder(sniff_charset(chunk, host))('replace')
+        text = decoder.decode(chunk, True)
+    else:
+        text = decoder.decode(b'', True)
+    if len(text) > 0:
+        yield text
+
+
+def sanitise_stream(texts):
+    '''
+    Make control characters in a text visible
+    
+    Text from servers must not be able to send escape sequences or other
+    control characters to the terminal, so they are replaced with caret
+    notation, or U+FFFD for C1 controls. Tabs and line feeds are kept,
+    carriage returns before line feeds are removed, and other carriage
+    returns are replaced, also when split from the line feed by a chunk
+    boundary
+    
+    @param   texts:itr<str>  The text, chunk by chunk
+    @return  :itr<str>       The sanitised text, chunk by chunk
+    '''
+    pending = ''
+    for text in texts:
+        text, pending = pending + text, ''
+        if text.endswith('\r'):
+            text, pending = text[:-1], '\r'
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '^M')
+        yield _control_pattern.sub(lambda match : _control_characters[ord(match.group())], text)
+    if len(pending) > 0:
+        yield '^M'
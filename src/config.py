@@ -34,8 +34,63 @@ default_protocol = 'gopher'
 :str  The protocol to use when no protocol has been specified
 '''
 
-default_port = {'gopher' : 70}
+default_port = {'gopher' : 70, 'gophers' : 70}
 '''
 :dict<str, int>  The port to use for each protocol when no port has been specified
 '''
 
+
+tab_spill_delay = 10 * 60
+'''
+:int  The number of seconds a tab must have been inactive before its content is moved to disk
+'''
+
+spill_compression_level = 6
+'''
+:int  The zlib compression level to use for content moved to disk, 0 to 9
+'''
+
+charset_sniff_size = 4096
+'''
+:int  The number of bytes at the beginning of a text item that are used to guess its character encoding
+'''
+
+charset_overrides = {}
+'''
+:dict<str, str>  Map from lower case hostname to the character encoding to use for text items from that host
+'''
+
+image_workers = 2
+'''
+:int  The number of processes to use for fetching and rendering images
+'''
+
+image_cache_size = 32
+'''
+:int  The number of rendered images to keep in memory
+'''
+
+image_preview_rows = 8
+'''
+:int  The number of lines to display previews of images in menus on, 0 to not display previews
+'''
+
+tls_schemes = {'gophers'}
+'''
+:set<str>  Schemes for which TLS is used
+'''
+
+tls_hosts = set()
+'''
+:set<str>  Lower case hostnames, optionally followed by a colon and a port, for which TLS is always used
+'''
+
+tls_verify = True
+'''
+:bool  Whether to verify the certificates of servers when using TLS
+'''
+
+tls_ca_file = None
+'''
+:str?  File with additional trusted certificates, in PEM format, `None` to only use the system's
+'''
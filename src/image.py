@@ -0,0 +1,229 @@
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os, time
+
+from net import *
+import config
+from config import *
+
+
+
+image_item_types = 'Igp'
+'''
+:str  The gopher item types that are images
+'''
+
+
+def render_image(url, columns, rows):
+    '''
+    Fetch an image and render it for display in the terminal
+    
+    The image is scaled to fit, keeping its aspect ratio, and drawn with
+    upper half block characters, with the foreground colour set to the
+    upper pixel and the background colour set to the lower pixel of
+    each cell. This function is run in worker processes, so neither
+    the download nor the decoding blocks the interface
+    
+    @param   url:str      The address of the image
+    @param   columns:int  The number of columns available
+    @param   rows:int     The number of lines available
+    @return  :list<str>?  The lines of the rendered image, `None` if
+                          the image cannot be fetched or decoded, or
+                          if Pillow is not installed
+    '''
+    try:
+        import io
+        from PIL import Image
+        (_item_type, host, port, selector, tls) = get_request(url)
+        image = Image.open(io.BytesIO(b''.join(fetch(host, port, selector, tls = tls))))
+        image.draft('RGB', (columns, rows * 2))
+        image = image.convert('RGB')
+    except Exception:
+        return None
+    scale = min(columns / image.width, rows * 2 / image.height)
+    size = (max(int(image.width * scale), 1), max(int(image.height * scale), 1))
+    image = image.resize(size)
+    (width, height), pixels = size, image.load()
+    lines = []
+    for y in range(0, height, 2):
+        line, last = '', None
+        for x in range(width):
+            top = pixels[x, y]
+            bottom = pixels[x, y + 1] if y + 1 < height else None
+            colour = '38;2;%i;%i;%i' % top
+            colour += ';48;2;%i;%i;%i' % bottom if bottom is not None else ';49'
+            if not colour == last:
+                line += '\033[%sm' % colour
+                last = colour
+            line += '▀'
+        lines.append(line + '\033[m')
+    return lines
+
+
+class ImageRenderer:
+    '''
+    Fetches and renders images in a pool of worker processes
+    
+    Rendered images are cached per address and size. Requests for
+    images that are not in the viewport are dropped if they have not
+    been started yet, and images in the viewport are rendered first.
+    When a rendering finishes, a byte is written to a pipe whose read
+    end is `wakeup_fd`, so the interface can wait for it together
+    with terminal input
+    
+    Images that could not be fetched or rendered are not cached, they
+    are reported as failed until `retry_delay` seconds have passed and
+    are then requested again, since the failure may be temporary
+    '''
+    
+    retry_delay = 30
+    '''
+    :float  The number of seconds to wait before retrying a failed image
+    '''
+    
+    def __init__(self, workers = None, cache_size = None):
+        '''
+        Constructor
+        
+        @param  workers:int?     The number of worker processes, `None` for `image_workers`
+        @param  cache_size:int?  The number of rendered images to keep, `None` for `image_cache_size`
+        '''
+        self.workers = config.image_workers if workers is None else workers
+        self.cache_size = config.image_cache_size if cache_size is None else cache_size
+        self.pool = None
+        self.cache = {}
+        self.failed = {}
+        self.queue = []
+        self.running = {}
+        (self.wakeup_fd, self._wakeup_write_fd) = os.pipe()
+        os.set_blocking(self.wakeup_fd, False)
+        os.set_blocking(self._wakeup_write_fd, False)
+    
+    
+    def get(self, url, columns, rows):
+        '''
+        Get a rendered image, and request it to be rendered if it is not available
+        
+        @param   url:str      The address of the image
+        @param   columns:int  The number of columns available
+        @param   rows:int     The number of lines available
+        @return  :list<str>?  The lines of the rendered image, `None` if it is not
+                              available yet, an empty list if it failed within `retry_delay` seconds
+        '''
+        key = (url, columns, rows)
+        if key in self.cache:
+            lines = self.cache.pop(key)
+            self.cache[key] = lines # most recently used last
+            return lines
+        if key in self.failed:
+            if time.monotonic() < self.failed[key] + self.retry_delay:
+                return []
+            del self.failed[key]
+        if key not in self.running and key not in self.queue:
+            self.queue.append(key)
+            self.submit()
+        return None
+    
+    
+    def set_viewport(self, urls):
+        '''
+        Select which images are in the viewport
+        
+        Queued requests for other images are dropped, and the
+        remaining requests are rendered in the specified order
+        
+        @param  urls:list<str>  The addresses of the images in the viewport, most important first
+        '''
+        order = {url : i for i, url in enumerate(urls)}
+        self.queue = [key for key in self.queue if key[0] in order]
+        self.queue.sort(key = lambda key : order[key[0]])
+        for key, future in list(self.running.items()):
+            if key[0] not in order and future.cancel():
+                del self.running[key]
+        self.submit()
+    
+    
+    def submit(self):
+        '''
+        Start rendering queued images, as long as there are idle workers
+        '''
+        if len(self.queue) > 0 and self.pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.pool = ProcessPoolExecutor(self.workers)
+        while len(self.queue) > 0 and len(self.running) < self.workers:
+            key, self.queue = self.queue[0], self.queue[1:]
+            future = self.pool.submit(render_image, *key)
+            self.running[key] = future
+            future.add_done_callback(self.wakeup)
+    
+    
+    def wakeup(self, _future):
+        '''
+        Notify the interface that a rendering has finished
+        '''
+        try:
+            os.write(self._wakeup_write_fd, b'\0')
+        except BlockingIOError:
+            pass
+    
+    
+    def poll(self):
+        '''
+        Move finished renderings to the cache and start queued renderings
+        
+        @return  :bool  Whether any rendering has finished
+        '''
+        try:
+            os.read(self.wakeup_fd, 4096)
+        except BlockingIOError:
+            pass
+        finished = False
+        for key, future in list(self.running.items()):
+            if future.done():
+                del self.running[key]
+                if not future.cancelled():
+                    try:
+                        lines = future.result()
+                    except Exception:
+                        lines = None
+                    if lines is None:
+                        now = time.monotonic()
+                        for failed_key, failed in list(self.failed.items()):
+                            if now >= failed + self.retry_delay:
+                                del self.failed[failed_key]
+                        self.failed[key] = now
+                    else:
+                        while len(self.cache) >= self.cache_size:
+                            del self.cache[next(iter(self.cache))]
+                        self.cache[key] = lines
+                    finished = True
+        self.submit()
+        return finished
+    
+    
+    def close(self):
+        '''
+        Stop the worker processes
+        '''
+        if self.pool is not None:
+            self.pool.shutdown(wait = False, cancel_futures = True)
+            self.pool = None
+        os.close(self.wakeup_fd)
+        os.close(self._wakeup_write_fd)
@@ -17,7 +17,16 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import time
+
+from net import *
+import config
+from config import *
+from charset import *
+from image import *
 from terminal import *
+from layout import *
+from session import *
 
 
 
@@ -29,7 +38,7 @@ hotkeys = {}
 
 def clen(string, original_len = len):
     '''
-    Colour-aware object length measurement function
+    Colour-aware and width-aware object length measurement function
     
     @param   string:object              The object to measure
     @param   original_len:(object)→int  The original implementation of `len`
@@ -37,31 +46,65 @@ def clen(string, original_len = len):
     '''
     if not isinstance(string, str):
         return original_len(string)
-    rc, esc = 0, False
-    for c in string:
-        if esc:
-            if c == 'm':
-                esc = False
-        elif c == '\033':
-            esc = True
-        else:
-            rc += 1
-    return rc
+    return display_width(string)
+
+
+tabs = []
+'''
+:list<Tab>  The open tabs
+'''
+
+current_tab = 0
+'''
+:int  The index of the tab that is displayed
+'''
+
+spill_store = None
+'''
+:SpillStore?  The store inactive tabs are moved to, set when the interface is started
+'''
 
+image_renderer = None
+'''
+:ImageRenderer?  Renders images in worker processes, set when the interface is started
+'''
 
-def start_interface():
+_winch_fd = None
+'''
+:int?  File descriptor that becomes readable when the terminal changes size
+'''
+
+_page_width = None
+'''
+:int?  The width of the page area the last time it was drawn
+'''
+
+
+def start_interface(addresses = []):
     '''
     Start the user interface
+    
+    @param  addresses:list<str>  Addresses to open in new tabs
     '''
+    global spill_store, image_renderer, current_tab, _winch_fd
     saved_stty = None
     populate_hotkeys()
+    spill_store = SpillStore()
+    image_renderer = ImageRenderer()
+    session = load_session(spill_store)
+    if session is None:
+        tabs[:], current_tab = [Tab(title = 'Welcome', page = Layout('Welcome to gopher-love'))], 0
+    else:
+        tabs[:], current_tab = session
+    for address in addresses:
+        open_url(address)
     
     try:
         initialise_terminal()
         hide_cursor()
         saved_stty = store_tty_settings()
         set_tty_settings(echo = False, isig = False, icanon = False, ixany = True, ixoff = False, ixon = False)
-        set_up_winch_listener(lambda : None)
+        _winch_fd = set_up_winch_listener(force_redraw)
         
         cont = True
         while cont:
@@ -69,12 +112,142 @@ def start_interface():
             (height, width) = get_terminal_size()
             draw_interface(1, 1, width, height)
             cont = interaction()
+            spill_idle_tabs(tabs, current_tab, spill_store)
+        save_session(tabs, current_tab, spill_store)
     finally:
+        image_renderer.close()
         restore_tty_settings(saved_stty)
         show_cursor()
         uninitialise_terminal()
 
 
+def load_item(url):
+    '''
+    Fetch an item and lay it out for display
+    
+    Text items are decoded and added to the layout as they are received,
+    so no complete copy of the item is held in memory. Only text items,
+    menus and search results are fetched here, images are fetched by
+    `image_renderer` when displayed, and other items are not displayed
+    
+    @param   url:str  The address of the item
+    @return  :Layout  The item as displayed
+    '''
+    page = Layout()
+    try:
+        (item_type, host, port, selector, tls) = get_request(url)
+        if item_type in image_item_types:
+            return page
+        if item_type not in ('0', '1', '7'):
+            return Layout('Cannot display %s: items of type %s are not text' % (url, item_type))
+        texts = sanitise_stream(decode_stream(fetch(host, port, selector, tls = tls), host))
+        if item_type in ('1', '7'):
+            texts = format_menu_stream(texts, page.links, (host, port, tls))
+        for text in texts:
+            page.append(text)
+    except OSError as err:
+        return Layout('Cannot load %s: %s' % (url, err.strerror or str(err)))
+    except (LookupError, ValueError) as err:
+        # For example an unsupported scheme or an unknown encoding in `charset_overrides`
+        return Layout('Cannot load %s: %s' % (url, str(err)))
+    finish_text_item(page.lines)
+    page.wraps.clear()
+    return page
+
+
+def format_menu_line(line):
+    '''
+    Format a line in a gopher menu for display
+    
+    @param   line:str  The line, as received from the server, with control
+                       characters, except tabs, already made visible
+    @return  :str      The line, as displayed
+    '''
+    if line in ('', '.'):
+        return line
+    display = line[1:].split('\t')[0]
+    if line[0] == 'i':
+        return '      ' + display
+    if line[0] == '3':
+        return '\033[31m' + display + '\033[m'
+    return '\033[34m%-5s\033[m %s' % ({'0' : 'TEXT', '1' : 'DIR', '7' : 'FIND', '9' : 'BIN',
+                                         'g' : 'GIF', 'I' : 'IMG', 'p' : 'PNG',
+                                         'h' : 'HTML'}.get(line[0], '?'), display)
+
+
+def get_menu_link(line, origin):
+    '''
+    Get the address a line in a gopher menu links to
+    
+    Entries on the same server as the menu are fetched over TLS
+    if the menu was, other entries use the gopher scheme
+    
+    @param   line:str                            The line, as received from the server
+    @param   origin:(host:str, port:int|str, tls:bool)
+                                                 Where the menu was fetched from
+    @return  :(item_type:str, url:str)?          The type of the linked item and its address,
+                                                 `None` if the line does not link to an item
+    '''
+    fields = line[1:].split('\t')
+    if len(line) == 0 or line[0] in 'i3.' or len(fields) < 4:
+        return None
+    (selector, host, port) = fields[1:4]
+    scheme = 'gopher'
+    if origin[2] and host.lower() == origin[0].lower() and port == str(origin[1]):
+        scheme = 'gophers'
+    return (line[0], construct_url(scheme, domain = host, port = port, path = selector, item_type = line[0]))
+
+
+def format_menu_stream(texts, links = None, origin = None):
+    '''
+    Format a gopher menu for display, line by line as it is received
+    
+    @param   texts:itr<str>                          The menu, chunk by chunk, as received from the server
+    @param   links:dict<int, (str, str)>?            If not `None`, `get_menu_link` for each line that
+                                                     links to an item is stored here, by line index
+    @param   origin:(host:str, port:int|str, tls:bool)?
+                                                     Where the menu was fetched from, required with `links`
+    @return  :itr<str>                               The menu, chunk by chunk, as displayed
+    '''
+    partial, index = '', 0
+    for text in texts:
+        lines = (partial + text).split('\n')
+        partial = lines.pop()
+        if links is not None:
+            for line in lines:
+                link = get_menu_link(line, origin)
+                if link is not None:
+                    links[index] = link
+                index += 1
+        if len(lines) > 0:
+            yield '\n'.join(format_menu_line(line) for line in lines) + '\n'
+    if links is not None:
+        link = get_menu_link(partial, origin)
+        if link is not None:
+            links[index] = link
+    yield format_menu_line(partial)
+
+
+def open_url(url, new_tab = True):
+    '''
+    Open an item
+    
+    @param  url:str       The address of the item
+    @param  new_tab:bool  Whether to open the item in a new tab rather than the current tab
+    '''
+    page = load_item(url)
+    if new_tab or len(tabs) == 0:
+        tabs.append(Tab(url, page = page))
+        select_tab(len(tabs) - 1)
+    else:
+        tab = tabs[current_tab]
+        if tab.url is not None:
+            tab.history.append(tab.url)
+        tab.url, tab.title, tab.raw, tab.page, tab.position = url, None, None, page, (0, 0)
+        tab.store_key = None
+        force_redraw()
+
+
 def draw_interface(x, y, width, height):
     '''
     Draw the interface
@@ -86,7 +259,7 @@ def draw_interface(x, y, width, height):
     @return  :(:int, :int, :int, :int)  Input parameter for the next interface drawing function
     '''
     size = (x, y, width, height)
-    parts = (draw_interface_tab, draw_interface_status, draw_interface_page)
+    parts = (draw_interface_tabs, draw_interface_status, draw_interface_page)
     for part in parts:
         size = part(*size)
     return size
@@ -102,9 +275,28 @@ def draw_interface_tabs(x, y, width, height):
     @param  height:int                  The number of lines of the drawable area of the screen
     @return  :(:int, :int, :int, :int)  Input parameter for the next interface drawing function
     '''
-    bar = 'Welcome'
-    bar = '\033[01;34;47m%s\033[00;07m' % bar
-    bar += ' ' * (width - clen(bar))
+    limit = max(width // 3, 12)
+    titles = []
+    for tab in tabs:
+        title = tab.get_title()
+        if display_width(title) > limit:
+            title = truncate(title, limit - 1) + '…'
+        titles.append(' %s ' % title)
+    # Scroll the tab bar so that the current tab is visible
+    first, used = current_tab, display_width(titles[current_tab])
+    while first > 0 and used + display_width(titles[first - 1]) <= width:
+        first -= 1
+        used += display_width(titles[first])
+    bar = ''
+    for i in range(first, len(tabs)):
+        if i == current_tab:
+            bar += '\033[01;34;47m%s\033[00;07m' % titles[i]
+        else:
+            bar += titles[i]
+        if display_width(bar) >= width:
+            break
+    bar = truncate(bar, width)
+    bar += ' ' * (width - display_width(bar))
     print('\033[%i;%iH\033[07m%s\033[m' % (y, x, bar), end = '', flush = True)
     y += 1
     height -= 1
@@ -136,7 +328,39 @@ def draw_interface_page(x, y, width, height):
     @param  height:int                  The number of lines of the drawable area of the screen
     @return  :(:int, :int, :int, :int)  Input parameter for the next interface drawing function
     '''
-    print('\033[%i;%iH%s' % (y, x, 'Welcome to gopher-love'))
+    global _page_width
+    _page_width = width
+    tab = tabs[current_tab]
+    tab.materialise(spill_store)
+    item_type = '1' if tab.url is None else parse_url(tab.url, config.default_protocol).get('item_type', '1')
+    if image_renderer is not None and item_type in image_item_types:
+        image_renderer.set_viewport([tab.url])
+        lines = image_renderer.get(tab.url, width, height)
+        if lines is None:
+            lines = ['Loading image...']
+        elif len(lines) == 0:
+            lines = ['Cannot display image']
+    else:
+        tab.position = tab.page.scroll(width, tab.position[0], tab.position[1], 0)
+        lines, previews = [], []
+        for (line, row, text) in tab.page.rows(width, *tab.position, height):
+            if len(lines) >= height:
+                break
+            lines.append(text)
+            link = tab.page.links.get(line, None)
+            if image_renderer is None or config.image_preview_rows <= 0 or link is None or link[0] not in image_item_types:
+                continue
+            if row + 1 == len(tab.page.line_wraps(line, width)):
+                # The preview is displayed below the last row of the menu entry
+                previews.append(link[1])
+                preview = image_renderer.get(link[1], max(width - 6, 1), config.image_preview_rows)
+                lines.extend('      ' + preview_line for preview_line in preview or [])
+        if image_renderer is not None:
+            image_renderer.set_viewport(previews)
+    buf = ''
+    for i, text in enumerate(lines[:height]):
+        buf += '\033[%i;%iH%s\033[m' % (y + i, x, text)
+    print(buf, end = '', flush = True)
     return (x, y, 0, 0)
 
 
@@ -152,13 +376,29 @@ def interaction():
     _interation_redraw = False
     _interation_quit = False
     while True:
-        input = read_terminal_input()
-        if input is None:
-            _interation_redraw = True
-        elif input in hotkeys:
-            hotkeys[input]()
-        else:
-            keyboard_pressed(input);
+        fds = [] if _winch_fd is None else [_winch_fd]
+        fds += [] if image_renderer is None else [image_renderer.wakeup_fd]
+        deadline = next_spill_time(tabs, current_tab)
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        ready = wait_for_terminal_input(fds, timeout)
+        if ready is None:
+            # Nothing happened for a while, so tabs may have become idle
+            spill_idle_tabs(tabs, current_tab, spill_store)
+            continue
+        if _winch_fd in ready:
+            clear_wakeup_fd(_winch_fd)
+            force_redraw()
+        if image_renderer is not None and image_renderer.wakeup_fd in ready:
+            if image_renderer.poll():
+                _interation_redraw = True
+        if len(ready) == 0:
+            input = read_terminal_input()
+            if input is None:
+                _interation_redraw = True
+            elif input in hotkeys:
+                hotkeys[input]()
+            else:
+                keyboard_pressed(input);
         if _interation_quit:
             return False
         if _interation_redraw:
@@ -181,11 +421,43 @@ def exit_program():
     _interation_quit = True
 
 
+def scroll_page(delta):
+    '''
+    Scroll the page
+    
+    @param  delta:int  The number of rows to scroll, negative to scroll up
+    '''
+    tab = tabs[current_tab]
+    if _page_width is not None and tab.is_materialised():
+        tab.position = tab.page.scroll(_page_width, tab.position[0], tab.position[1], delta)
+        force_redraw()
+
+
+def select_tab(index):
+    '''
+    Switch to another tab
+    
+    @param  index:int  The index of the tab, negative to count from the end
+    '''
+    global current_tab
+    if -len(tabs) <= index < len(tabs):
+        tabs[current_tab].last_active = time.monotonic()
+        current_tab = index % len(tabs)
+        tabs[current_tab].materialise(spill_store)
+        force_redraw()
+
+
 def populate_hotkeys():
     '''
     Populate the hotkey map
     '''
     hotkeys[ctrl('L')] = force_redraw
+    hotkeys[ctrl('N')] = lambda : scroll_page(1)
+    hotkeys[ctrl('P')] = lambda : scroll_page(-1)
+    hotkeys[meta('n')] = lambda : select_tab((current_tab + 1) % len(tabs))
+    hotkeys[meta('p')] = lambda : select_tab(current_tab - 1)
+    for i in range(1, 10):
+        hotkeys[meta(str(i))] = (lambda index : lambda : select_tab(index))(i - 1)
     hotkeys[ctrl('Q')] = exit_program
 
 
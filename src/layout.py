@@ -0,0 +1,346 @@
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import unicodedata, functools, bisect
+
+
+
+_char_widths = {}
+'''
+:dict<str, int>  Cache of the display width of each character that has been measured
+'''
+
+
+def char_width(c):
+    '''
+    Get the number of columns a character occupies in the terminal
+    
+    Wide and fullwidth characters, according to the East Asian Width
+    property, occupy two columns, combining marks, format characters
+    and control characters occupy no columns, and all other characters
+    occupy one column
+    
+    @param   c:str  The character
+    @return  :int   The number of columns the character occupies
+    '''
+    if c < '\u0300' and c >= ' ' and not c == '\x7f':
+        return 1
+    width = _char_widths.get(c, None)
+    if width is None:
+        if unicodedata.category(c) in ('Mn', 'Me', 'Cf', 'Cc') and not c == '\u00ad':
+            width = 0
+        elif unicodedata.east_asian_width(c) in ('W', 'F'):
+            width = 2
+        else:
+            width = 1
+        _char_widths[c] = width
+    return width
+
+
+def escape_end(string, index):
+    '''
+    Find the end of an escape sequence
+    
+    Control sequences (CSI), string sequences such as operating
+    system commands (OSC), and two-character escape sequences
+    are recognised
+    
+    @param   string:str  The string containing the escape sequence
+    @param   index:int   The index of the ESC that begins the sequence
+    @return  :int        The index of the first character after the sequence
+    '''
+    n = len(string)
+    index += 1
+    if index == n:
+        return n
+    c = string[index]
+    index += 1
+    if c == '[':
+        while index < n and ' ' <= string[index] <= '?':
+            index += 1
+        return min(index + 1, n)
+    if c in ']P_^X':
+        while index < n:
+            if string[index] == '\a':
+                return index + 1
+            if string[index] == '\033':
+                return min(index + 2, n)
+            index += 1
+        return n
+    while ' ' <= c <= '/' and index < n:
+        c = string[index]
+        index += 1
+    return index
+
+
+@functools.lru_cache(maxsize = 4096)
+def display_width(string):
+    '''
+    Get the number of columns a string occupies in the terminal
+    
+    Escape sequences are ignored. The result is cached
+    since the same strings are measured at every redraw
+    
+    @param   string:str  The string to measure
+    @return  :int        The number of columns the string occupies
+    '''
+    if '\033' not in string and string.isascii() and string.isprintable():
+        return len(string)
+    rc, i, n = 0, 0, len(string)
+    while i < n:
+        if string[i] == '\033':
+            i = escape_end(string, i)
+        else:
+            rc += char_width(string[i])
+            i += 1
+    return rc
+
+
+def truncate(string, width):
+    '''
+    Cut a string to fit in a number of columns
+    
+    @param   string:str  The string, escape sequences do not occupy any columns
+    @param   width:int   The number of columns available
+    @return  :str        The longest beginning of `string` that fits
+    '''
+    if display_width(string) <= width:
+        return string
+    col, i, n = 0, 0, len(string)
+    while i < n:
+        if string[i] == '\033':
+            i = escape_end(string, i)
+            continue
+        col += char_width(string[i])
+        if col > width:
+            break
+        i += 1
+    return string[:i]
+
+
+def expand_tabs(line, column = 0, tab_width = 8):
+    '''
+    Replace tab characters with spaces up to the next tab stop
+    
+    @param   line:str       The line, without line break
+    @param   column:int     The column the line begins at
+    @param   tab_width:int  The number of columns between tab stops
+    @return  :str           The line without tab characters
+    '''
+    if '\t' not in line:
+        return line
+    parts = line.split('\t')
+    rc = parts[0]
+    column += display_width(parts[0])
+    for part in parts[1:]:
+        spaces = tab_width - column % tab_width
+        rc += ' ' * spaces + part
+        column += spaces + display_width(part)
+    return rc
+
+
+def wrap_line(line, width):
+    '''
+    Calculate where a line shall be wrapped
+    
+    @param   line:str    The line, without line break
+    @param   width:int   The number of columns available
+    @return  :list<int>  The index in `line` of the first character
+                         of each row, always begins with 0
+    '''
+    if '\033' not in line and line.isascii() and line.isprintable():
+        return list(range(0, max(len(line), 1), max(width, 1)))
+    rc, col, i, n = [0], 0, 0, len(line)
+    while i < n:
+        if line[i] == '\033':
+            i = escape_end(line, i)
+            continue
+        w = char_width(line[i])
+        if col + w > width and col > 0:
+            rc.append(i)
+            col = 0
+        col += w
+        i += 1
+    return rc
+
+
+class Layout:
+    '''
+    Line index of a document with cached wrapping
+    
+    Wrap points are calculated lazily, one line at a time, and are
+    cached per width. When the width changes, only the lines that
+    are displayed are wrapped, so resizing the terminal does not
+    require the entire document to be wrapped
+    
+    `links` maps the index of each line that links to an item
+    to the type of the item and its address
+    '''
+    
+    max_widths = 4
+    '''
+    :int  The number of widths to keep wrap points cached for
+    '''
+    
+    def __init__(self, text = ''):
+        '''
+        Constructor
+        
+        Tab characters are expanded to spaces
+        
+        @param  text:str  The text of the document
+        '''
+        self.lines = [expand_tabs(line) for line in text.split('\n')]
+        self.wraps = {}
+        self.links = {}
+    
+    
+    def append(self, text):
+        '''
+        Append text to the end of the document
+        
+        The text may end in the middle of a line, the line is continued
+        by the next call. A carriage return before a line feed is removed,
+        and tab characters are expanded to spaces
+        
+        @param  text:str  The text to append
+        '''
+        parts = text.split('\n')
+        last = len(self.lines) - 1
+        self.lines[last] += parts[0]
+        self.lines.extend(parts[1:])
+        for i in range(last, len(self.lines) - 1):
+            if self.lines[i].endswith('\r'):
+                self.lines[i] = self.lines[i][:-1]
+        if '\t' in text:
+            for i in range(last, len(self.lines)):
+                self.lines[i] = expand_tabs(self.lines[i])
+        for wraps in self.wraps.values():
+            if last < len(wraps):
+                wraps[last] = None
+    
+    
+    def get_wraps(self, width):
+        '''
+        Get the wrap point cache for a width
+        
+        @param   width:int          The number of columns available
+        @return  :list<list<int>?>  The wrap points for each line, `None` for lines
+                                    that have not been wrapped yet
+        '''
+        wraps = self.wraps.pop(width, None)
+        if wraps is None:
+            while len(self.wraps) >= self.max_widths:
+                del self.wraps[next(iter(self.wraps))]
+            wraps = [None] * len(self.lines)
+        elif len(wraps) < len(self.lines):
+            wraps.extend([None] * (len(self.lines) - len(wraps)))
+        self.wraps[width] = wraps # most recently used last
+        return wraps
+    
+    
+    def line_wraps(self, index, width):
+        '''
+        Get the wrap points for a line
+        
+        @param   index:int   The index of the line
+        @param   width:int   The number of columns available
+        @return  :list<int>  The index of the first character of each row
+        '''
+        wraps = self.get_wraps(width)
+        if wraps[index] is None:
+            wraps[index] = wrap_line(self.lines[index], width)
+        return wraps[index]
+    
+    
+    def row_at(self, index, offset, width):
+        '''
+        Get the row in a line that contains a character
+        
+        @param   index:int   The index of the line
+        @param   offset:int  The index of the character in the line
+        @param   width:int   The number of columns available
+        @return  :int        The index of the row in the line
+        '''
+        return max(bisect.bisect_right(self.line_wraps(index, width), offset) - 1, 0)
+    
+    
+    def rows(self, width, line, offset, count):
+        '''
+        Get the rows of the document as displayed
+        
+        @param   width:int               The number of columns available
+        @param   line:int                The index of the line at the top
+        @param   offset:int              The index, in that line, of a character
+                                         in the row at the top
+        @param   count:int               The maximum number of rows to get
+        @return  :list<(int, int, str)>  The index of the line, the row in the line,
+                                         and the text, for each row
+        '''
+        rc = []
+        line = min(max(line, 0), len(self.lines) - 1)
+        row = self.row_at(line, offset, width)
+        while line < len(self.lines) and len(rc) < count:
+            text, points = self.lines[line], self.line_wraps(line, width)
+            for i in range(row, len(points)):
+                end = points[i + 1] if i + 1 < len(points) else len(text)
+                rc.append((line, i, text[points[i] : end]))
+                if len(rc) == count:
+                    break
+            line, row = line + 1, 0
+        return rc
+    
+    
+    def scroll(self, width, line, offset, delta):
+        '''
+        Move a position by a number of rows
+        
+        Positions are stored as character offsets rather than rows,
+        so that the same text stays at the top when the width changes
+        
+        @param   width:int                The number of columns available
+        @param   line:int                 The index of the line
+        @param   offset:int               The index of a character in the line
+        @param   delta:int                The number of rows to move, negative to move up
+        @return  :(line:int, offset:int)  The new position, clamped to the document, the
+                                          offset is the first character of the row, or
+                                          unchanged if `delta` is 0
+        '''
+        line = min(max(line, 0), len(self.lines) - 1)
+        if delta == 0:
+            return (line, offset)
+        row = self.row_at(line, offset, width)
+        while delta > 0:
+            if row + 1 < len(self.line_wraps(line, width)):
+                row += 1
+            elif line + 1 < len(self.lines):
+                line, row = line + 1, 0
+            else:
+                break
+            delta -= 1
+        while delta < 0:
+            if row > 0:
+                row -= 1
+            elif line > 0:
+                line -= 1
+                row = len(self.line_wraps(line, width)) - 1
+            else:
+                break
+            delta += 1
+        return (line, self.line_wraps(line, width)[row])
@@ -17,6 +17,10 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import config
+from config import *
+
+
 
 def connect(host, port, protocol = 'tcp'):
     '''
@@ -28,10 +32,152 @@ def connect(host, port, protocol = 'tcp'):
     @return  :Popen        Control object for the created instance `netcat`
     '''
     from subprocess import Popen, PIPE
-    return Popen(['nc', {'tcp' : '-t', 'udp' : '-p'}[protocol.lower()], hostname, str(port)],
+    return Popen(['nc', {'tcp' : '-t', 'udp' : '-p'}[protocol.lower()], host, str(port)],
                  stdin = PIPE, stdout = PIPE, stderr = PIPE)
 
 
+_tls_context = None
+'''
+:SSLContext?  The TLS context used when no context is specified, created when first needed
+'''
+
+_tls_sessions = {}
+'''
+:dict<(SSLContext, str, int), SSLSession>  The last TLS session with each host and port, per TLS context
+'''
+
+
+def get_tls_context():
+    '''
+    Get the default TLS context
+    
+    @return  :SSLContext  The TLS context configured by `tls_verify` and `tls_ca_file`
+    '''
+    global _tls_context
+    if _tls_context is None:
+        import ssl
+        context = ssl.create_default_context(cafile = config.tls_ca_file)
+        if not config.tls_verify:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        _tls_context = context
+    return _tls_context
+
+
+def use_tls(scheme, host, port):
+    '''
+    Check whether an item shall be fetched over TLS
+    
+    @param   scheme:str  The scheme of the address of the item
+    @param   host:str    The host of the item
+    @param   port:int    The port of the item
+    @return  :bool       Whether to use TLS, either because the scheme is a TLS
+                         scheme or because the host is listed in `tls_hosts`
+    '''
+    host = host.lower()
+    return scheme in config.tls_schemes or host in config.tls_hosts or ('%s:%s' % (host, port)) in config.tls_hosts
+
+
+def get_request(url):
+    '''
+    Get what to send, and where, to fetch the item at an address
+    
+    `LookupError` is raised if the scheme is not supported
+    
+    @param   url:str  The address of the item
+    @return  :(item_type:str, host:str, port:int|str, selector:str, tls:bool)
+                      The type of the item, where to connect, the selector,
+                      and whether to use TLS
+    '''
+    params = parse_url(url, config.default_protocol)
+    scheme = params['scheme'] if 'scheme' in params else config.default_protocol
+    if scheme not in config.default_port:
+        raise LookupError('unsupported scheme: %s' % scheme)
+    host = url_unescape(params['domain'])
+    port = params['port'] if 'port' in params else config.default_port[scheme]
+    item_type = params['item_type'] if 'item_type' in params else '1'
+    selector = url_unescape(params['path']) if 'item_type' in params else ''
+    if 'query_string' in params:
+        selector += '\t' + url_unescape(params['query_string'])
+    return (item_type, host, port, selector, use_tls(scheme, host, port))
+
+
+def fetch(host, port, selector, metrics = None, chunk_size = 4096, timeout = None, tls = False, context = None):
+    '''
+    Fetch an item from a gopher server
+    
+    When TLS is used, the session is remembered per host and port,
+    so that later fetches from the same server can resume the session
+    with an abbreviated handshake
+    
+    @param   host:str                   The host to connect to
+    @param   port:int                   The port to connect to
+    @param   selector:str               The selector of the item, unescaped
+    @param   metrics:dict<str, float>?  If not `None`, timing measurements, in seconds, are stored
+                                        here: 'connect', 'handshake' (only with TLS), 'first_byte'
+                                        and 'total', all measured from the start of the request,
+                                        'bytes', the number of received bytes, and, with TLS,
+                                        'session_reused', whether the TLS session was resumed
+    @param   chunk_size:int             The maximum number of bytes to read at a time
+    @param   timeout:float?             Socket timeout in seconds, `None` for no timeout
+    @param   tls:bool                   Whether to use TLS
+    @param   context:SSLContext?        The TLS context, `None` for `get_tls_context()`
+    @return  :itr<bytes>                The content of the item, chunk by chunk
+    '''
+    import socket, time
+    start = time.perf_counter()
+    sock = socket.create_connection((host, port), timeout)
+    try:
+        if metrics is not None:
+            metrics['connect'] = time.perf_counter() - start
+            metrics['bytes'] = 0
+        if tls:
+            context = get_tls_context() if context is None else context
+            session = _tls_sessions.get((context, host, port), None)
+            sock = context.wrap_socket(sock, server_hostname = host, session = session)
+            if metrics is not None:
+                metrics['handshake'] = time.perf_counter() - start
+                metrics['session_reused'] = sock.session_reused
+        sock.sendall(selector.encode('utf-8') + b'\r\n')
+        while True:
+            chunk = sock.recv(chunk_size)
+            if len(chunk) == 0:
+                break
+            if metrics is not None:
+                if metrics['bytes'] == 0:
+                    metrics['first_byte'] = time.perf_counter() - start
+                metrics['bytes'] += len(chunk)
+            yield chunk
+        if tls and sock.session is not None:
+            # With TLS 1.3 the session ticket arrives after the
+            # handshake, so the session is stored after reading
+            _tls_sessions[(context, host, port)] = sock.session
+    finally:
+        sock.close()
+        if metrics is not None:
+            metrics['total'] = time.perf_counter() - start
+
+
+def finish_text_item(lines):
+    '''
+    Remove the gopher transport encoding from a text item
+    
+    The terminating full stop line is removed, and lines
+    starting with two full stops have the first removed
+    
+    @param  lines:list<str>  The lines of the item, will be updated
+    '''
+    while len(lines) > 0 and lines[-1] == '':
+        lines.pop()
+    if len(lines) > 0 and lines[-1] == '.':
+        lines.pop()
+    for i, line in enumerate(lines):
+        if line.startswith('..'):
+            lines[i] = line[1:]
+    if len(lines) == 0:
+        lines.append('')
+
+
 def punycode(address):
     '''
     Convert an IDN address to traditional limited ASCII format using punycode
@@ -41,6 +187,8 @@ def punycode(address):
     '''
     import encodings.punycode
     def partial(part):
+        if all(ord(c) < 128 for c in part):
+            return part
         puny = encodings.punycode.punycode_encode(part).decode('utf-8', 'strict').rstrip('-')
         return ('' if puny == part else 'xn--') + puny
     return '.'.join(partial(part) for part in address.split('.'))
@@ -50,7 +198,7 @@ def parse_url(url, fallback_scheme):
     '''
     Parse an URL string
     
-    This function supports generic syntax and gopher
+    This function supports generic syntax, gopher and gophers
     
     @param   url:str              The URL string
     @param   fallback_scheme:str  The scheme to assume the URL uses if
@@ -58,7 +206,9 @@ def parse_url(url, fallback_scheme):
     @return  :dict<str, ¿V?>      Parameters from `construct_url`, `**extras` in
                                   `construct_url` is unioned with the other parameters.
                                   Omitted parameters are not included. String will not
-                                  be unescaped, they will be returned in %-escaped form
+                                  be unescaped, they will be returned in %-escaped form.
+                                  For gopher, 'path' is the selector, as it appears after
+                                  the item type, without any '/' added
     '''
     rc = {}
     scheme = fallback_scheme
@@ -70,8 +220,10 @@ def parse_url(url, fallback_scheme):
         parts = url.split('?')
         url, query = parts[0], '?'.join(parts[1:])
         parts = query.split('#')
-        query, url = parts[0], url + '#'.join(parts[1:])
-        rc['query_string'] = query_string
+        query = parts[0]
+        if len(parts) > 1:
+            url += '#' + '#'.join(parts[1:])
+        rc['query_string'] = query
     if '#' in url:
         parts = url.split('#')
         url, fragment = parts[0], '#'.join(parts[1:])
@@ -79,10 +231,13 @@ def parse_url(url, fallback_scheme):
     if '/' in url:
         parts = url.split('/')
         url, path = parts[0], '/'.join(parts[1:])
-        if (scheme == 'gopher') and (not path == ''):
+        if (scheme in ('gopher', 'gophers')) and (not path == ''):
+            # The selector is everything after the item type, unchanged
             item_type, path = path[0], path[1:]
             rc['item_type'] = item_type
-        rc['path'] = '/' + path
+            rc['path'] = path
+        else:
+            rc['path'] = '/' + path
     if '@' in url:
         parts = url.split('@')
         login, url = parts[0], '@'.join(parts[1:])
@@ -96,6 +251,7 @@ def parse_url(url, fallback_scheme):
         url = url.replace('[', '')
         parts = url.split(']')
         domain, url = parts[0], ']'.join(parts[1:])
+        url = url[1:] if url.startswith(':') else url
     elif ':' in url:
         parts = url.split(':')
         domain, url = parts[0], ':'.join(parts[1:])
@@ -104,9 +260,9 @@ def parse_url(url, fallback_scheme):
     rc['domain'] = domain
     if not url == '':
         try:
-            rc['port'] = int(port)
+            rc['port'] = int(url)
         except:
-            rc['port'] = port
+            rc['port'] = url
     return rc
 
 
@@ -115,28 +271,29 @@ def construct_url(scheme, user = None, password = None, domain = None, port = No
     '''
     Construct an URL string
     
-    This function supports generic syntax and gopher
+    This function supports generic syntax, gopher and gophers
     
     @param   scheme:str?        The protocol, `None` to omit
     @param   user:str?          The username, `None` to omit
     @param   password:str?      The password, `None` to omit
     @param   domain:str?        The hostname, `None` to omit
     @param   port:int|str?      The port, `None` to omit
-    @param   path:str?          The pathname, `None` to omit
+    @param   path:str?          The pathname, `None` to omit, for gopher with
+                                'item_type' this is the selector, used unchanged
     @param   query_string:str?  The query, `None` to omit
     @param   fragment_id:str?   The anchor, `None` to omit
     @param   extras:**          Extras scheme specific parameters,
-                                'item_type' is available for gopher
+                                'item_type' is available for gopher and gophers
     @return  :str               The URL
     '''
-    domain = punycode(domain)
-    port = str(port)
-    item_type = extras['item_type'] if (scheme == 'gopher') and ('item_type' in extras) else None
+    domain = None if domain is None else punycode(domain)
+    port = None if port is None else str(port)
+    item_type = extras['item_type'] if (scheme in ('gopher', 'gophers')) and ('item_type' in extras) else None
     reserved = '%!*\'();:@&=+$,/?#[]' # % must be first
     for c in range(0, ord(' ')):
         reserved += chr(c)
     for c in reserved:
-        cc = '%02x' % c.encode('utf-8')[0]
+        cc = '%%%02x' % c.encode('utf-8')[0]
         if scheme       is not None:                    scheme       = scheme      .replace(c, cc)
         if user         is not None:                    user         = user        .replace(c, cc)
         if password     is not None:                    password     = password    .replace(c, cc)
@@ -147,7 +304,7 @@ def construct_url(scheme, user = None, password = None, domain = None, port = No
         if fragment_id  is not None:                    fragment_id  = fragment_id .replace(c, cc)
         if item_type    is not None:                    item_type    = item_type   .replace(c, cc)
     url = ''
-    while '//' in path:
+    while path is not None and item_type is None and '//' in path:
         path = path.replace('//', '/')
     if scheme       is not None:  url += scheme + '://'
     if user         is not None:  url += user
@@ -155,17 +312,19 @@ def construct_url(scheme, user = None, password = None, domain = None, port = No
     if user is not None or password is not None:
         url += '@'
     if domain       is not None:  url += '[%s]' % domain if ':' in domain else domain
-    if port         is not None:  url += ':%i' % port
-    if path         is not None:  url += '/' + ('' if item_type is None else item_type) + path.lstrip('/')
+    if port         is not None:  url += ':' + port
+    if path         is not None:  url += '/' + (path.lstrip('/') if item_type is None else item_type + path)
     if query_string is not None:  url += '?' + query_string
     if fragment_id  is not None:  url += '#' + fragment_id
-    return ''.join(chr(c) if c < 128 else ('%02x' % c) for c in url.encode('utf-8'))
+    return ''.join(chr(c) if c < 128 else ('%%%02x' % c) for c in url.encode('utf-8'))
 
 
 def url_unescape(text):
     '''
     Unescape a %-escaped string in an URL
     
+    The string is decoded as UTF-8, or as Latin-1 if it is not valid UTF-8
+    
     @param   text:str  The %-escaped string
     @return  :str      The string, unescaped
     '''
@@ -181,6 +340,9 @@ def url_unescape(text):
         elif c == '%':
             esc, a, b = True, None, None
         else:
-            buf.append(ord(c))
-    return bytes(buf).decode('utf-8', 'strict')
+            buf.extend(c.encode('utf-8'))
+    try:
+        return bytes(buf).decode('utf-8', 'strict')
+    except UnicodeDecodeError:
+        return bytes(buf).decode('latin-1')
 
@@ -0,0 +1,226 @@
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os, time
+
+import config
+from config import *
+from layout import *
+from store import *
+
+
+
+class Tab:
+    '''
+    A tab and its content
+    
+    The content of a tab, that is, the raw item and the page, can be
+    moved to a `SpillStore`, in which case `store_key` references it
+    and it is loaded back when the tab is materialised
+    '''
+    
+    def __init__(self, url = None, title = None, raw = None, page = None, history = None):
+        '''
+        Constructor
+        
+        @param  url:str?           The address of the item displayed in the tab
+        @param  title:str?         The title of the tab, `None` to use the address
+        @param  raw:bytes?         The item as received from the server
+        @param  page:Layout?       The item as displayed
+        @param  history:list<str>  Addresses previously visited in the tab, oldest first
+        '''
+        self.url = url
+        self.title = title
+        self.raw = raw
+        self.page = Layout() if page is None else page
+        self.position = (0, 0)
+        self.history = [] if history is None else history
+        self.store_key = None
+        self.last_active = time.monotonic()
+    
+    
+    def get_title(self):
+        '''
+        Get the title of the tab
+        
+        @return  :str  The title of the tab
+        '''
+        if self.title is not None:
+            return self.title
+        return self.url if self.url is not None else 'New tab'
+    
+    
+    def is_materialised(self):
+        '''
+        Check whether the content of the tab is in memory
+        
+        @return  :bool  Whether the content is in memory
+        '''
+        return self.page is not None
+    
+    
+    def store(self, spill_store):
+        '''
+        Ensure that the content of the tab is in a store
+        
+        @param   spill_store:SpillStore  The store
+        @return  :str                    The key of the content in the store
+        '''
+        if self.store_key is None:
+            self.store_key = spill_store.put({'raw' : self.raw, 'text' : '\n'.join(self.page.lines),
+                                             'links' : self.page.links})
+        return self.store_key
+    
+    
+    def spill(self, spill_store):
+        '''
+        Move the content of the tab to a store
+        
+        @param  spill_store:SpillStore  The store
+        '''
+        if self.is_materialised():
+            self.store(spill_store)
+            self.raw, self.page = None, None
+    
+    
+    def materialise(self, spill_store):
+        '''
+        Load the content of the tab from a store, if it is not in memory
+        
+        @param  spill_store:SpillStore  The store
+        '''
+        if not self.is_materialised():
+            content = spill_store.get(self.store_key)
+            if content is None:
+                self.store_key = None
+                self.raw, self.page = None, Layout('%s is no longer available' % self.get_title())
+            else:
+                self.raw, self.page = content['raw'], Layout(content['text'])
+                self.page.links = content.get('links', {})
+        self.last_active = time.monotonic()
+
+
+def spill_idle_tabs(tabs, current, spill_store, delay = None):
+    '''
+    Move the content of tabs that have been inactive for too long to a store
+    
+    @param  tabs:list<Tab>          The tabs
+    @param  current:int             The index of the current tab, it is never moved
+    @param  spill_store:SpillStore  The store
+    @param  delay:int?              The number of seconds a tab must have been
+                                    inactive, `None` for `tab_spill_delay`
+    '''
+    deadline = time.monotonic() - (config.tab_spill_delay if delay is None else delay)
+    for i, tab in enumerate(tabs):
+        if not i == current and tab.is_materialised() and tab.last_active <= deadline:
+            tab.spill(spill_store)
+
+
+def next_spill_time(tabs, current, delay = None):
+    '''
+    Get when `spill_idle_tabs` will next have a tab to move
+    
+    @param   tabs:list<Tab>  The tabs
+    @param   current:int     The index of the current tab, it is never moved
+    @param   delay:int?      The number of seconds a tab must have been
+                             inactive, `None` for `tab_spill_delay`
+    @return  :float?         The time, according to `time.monotonic`, `None`
+                             if no tab will be moved unless tabs are changed
+    '''
+    delay = config.tab_spill_delay if delay is None else delay
+    times = [tab.last_active + delay for i, tab in enumerate(tabs) if not i == current and tab.is_materialised()]
+    return min(times) if len(times) > 0 else None
+
+
+def get_session_file():
+    '''
+    Get the pathname of the session file
+    
+    @return  :str  The pathname of the session file
+    '''
+    return os.path.join(get_data_directory(), 'session')
+
+
+def save_session(tabs, current, spill_store, path = None):
+    '''
+    Save a session
+    
+    The session file contains the tabs, their history and scroll positions,
+    and references to their content in the store, but not the content itself
+    
+    The content of every tab that has not already been moved to the store is
+    compressed and written to it here, so the time this takes grows with the
+    amount of content in tabs that have been active since they were loaded
+    
+    @param  tabs:list<Tab>          The tabs
+    @param  current:int             The index of the current tab
+    @param  spill_store:SpillStore  The store to put the content of the tabs in
+    @param  path:str?               The session file, `None` for the default
+    '''
+    import json, zlib
+    path = get_session_file() if path is None else path
+    session = {'current' : current, 'store' : spill_store.name, 'tabs' : []}
+    for tab in tabs:
+        session['tabs'].append({'url' : tab.url, 'title' : tab.title, 'history' : tab.history,
+                                'position' : list(tab.position), 'ref' : tab.store(spill_store)})
+    data = zlib.compress(json.dumps(session, separators = (',', ':')).encode('utf-8'))
+    os.makedirs(os.path.dirname(path), mode = 0o700, exist_ok = True)
+    with open(path + '~', 'wb') as file:
+        file.write(data)
+    os.replace(path + '~', path)
+    spill_store.prune(tab.store_key for tab in tabs)
+
+
+def load_session(spill_store, path = None):
+    '''
+    Restore a session
+    
+    Only the current tab is materialised, the
+    other tabs are loaded when they are selected
+    
+    The content of the tabs is linked from the directory, in the
+    store, of the instance that saved the session, into the directory
+    of this instance, so it is kept even if another instance that has
+    restored the same session removes it
+    
+    @param   spill_store:SpillStore           The store the content of the tabs is in
+    @param   path:str?                        The session file, `None` for the default
+    @return  :(tabs:list<Tab>, current:int)?  The tabs and the index of the current tab,
+                                              `None` if there is no session to restore
+    '''
+    import json, zlib
+    path = get_session_file() if path is None else path
+    try:
+        with open(path, 'rb') as file:
+            session = json.loads(zlib.decompress(file.read()).decode('utf-8'))
+    except (OSError, zlib.error, ValueError):
+        return None
+    tabs = []
+    for saved in session['tabs']:
+        tab = Tab(saved['url'], saved['title'], history = saved['history'])
+        tab.position = tuple(saved['position'])
+        tab.raw, tab.page, tab.store_key = None, None, saved['ref']
+        if 'store' in session:
+            spill_store.adopt(session['store'], tab.store_key)
+        tabs.append(tab)
+    if len(tabs) == 0:
+        return None
+    current = min(max(session['current'], 0), len(tabs) - 1)
+    tabs[current].materialise(spill_store)
+    return (tabs, current)
@@ -0,0 +1,194 @@
+# -*- python -*-
+'''
+gopher-love – an extensible gopher browser
+Copyright © 2015  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+
+import config
+from config import *
+
+
+
+def get_data_directory():
+    '''
+    Get the directory where the program stores its persistent data
+    
+    @return  :str  The directory, it may not exist yet
+    '''
+    if 'XDG_DATA_HOME' in os.environ and not os.environ['XDG_DATA_HOME'] == '':
+        return os.path.join(os.environ['XDG_DATA_HOME'], PROGRAM_NAME)
+    import pwd
+    home = os.environ['HOME'] if 'HOME' in os.environ else pwd.getpwuid(os.getuid()).pw_dir
+    return os.path.join(home, '.local', 'share', PROGRAM_NAME)
+
+
+class SpillStore:
+    '''
+    Disk-backed store for compressed objects
+    
+    Objects are pickled, compressed and stored in one file each,
+    named by the SHA-1 sum of the compressed data, so identical
+    objects are only stored once
+    
+    Each running instance of the program has a directory of its own
+    in the store, which it holds a lock on, so that an instance never
+    removes objects that another instance still uses. An instance that
+    restores a session links the objects the session references into
+    its own directory
+    '''
+    
+    def __init__(self, root = None, level = None):
+        '''
+        Constructor
+        
+        @param  root:str?   The directory to store the objects in, `None` for the default,
+                            the objects are stored in a subdirectory for this instance
+        @param  level:int?  The zlib compression level, `None` for `spill_compression_level`
+        '''
+        if root is None:
+            root = os.path.join(get_data_directory(), 'store')
+        self.root = root
+        self.name = '%i-%s' % (os.getpid(), os.urandom(4).hex())
+        self.directory = os.path.join(root, self.name)
+        self.level = config.spill_compression_level if level is None else level
+        self._lock_file = None
+    
+    
+    def path(self, key):
+        '''
+        Get the pathname of the file an object is stored in
+        
+        @param   key:str  The key of the object
+        @return  :str     The pathname of the file
+        '''
+        return os.path.join(self.directory, key)
+    
+    
+    def make_directory(self):
+        '''
+        Create and lock the directory of this instance, if it has not been created yet
+        
+        The directory is created under a temporary name and renamed once
+        it is locked, so other instances never see it unlocked
+        '''
+        if self._lock_file is not None:
+            return
+        import fcntl
+        os.makedirs(self.root, mode = 0o700, exist_ok = True)
+        os.mkdir(self.directory + '~', mode = 0o700)
+        self._lock_file = open(os.path.join(self.directory + '~', 'lock'), 'wb')
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        os.rename(self.directory + '~', self.directory)
+    
+    
+    def put(self, obj):
+        '''
+        Store an object
+        
+        @param   obj:¿V?  The object, must be picklable
+        @return  :str     The key of the object
+        '''
+        import pickle, zlib, hashlib
+        data = zlib.compress(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), self.level)
+        key = hashlib.sha1(data).hexdigest()
+        path = self.path(key)
+        if not os.path.exists(path):
+            self.make_directory()
+            with open(path + '~', 'wb') as file:
+                file.write(data)
+            os.replace(path + '~', path)
+        return key
+    
+    
+    def adopt(self, name, key):
+        '''
+        Link an object from the directory of another instance into the directory of this instance
+        
+        Nothing is done if the object does not exist
+        
+        @param  name:str  The name of the directory of the other instance
+        @param  key:str   The key of the object
+        '''
+        source = os.path.join(self.root, name, key)
+        if name == self.name or os.path.exists(self.path(key)) or not os.path.exists(source):
+            return
+        self.make_directory()
+        try:
+            os.link(source, self.path(key))
+        except FileExistsError:
+            pass
+        except OSError:
+            import shutil
+            try:
+                shutil.copyfile(source, self.path(key) + '~')
+                os.replace(self.path(key) + '~', self.path(key))
+            except OSError:
+                pass
+    
+    
+    def get(self, key):
+        '''
+        Load an object
+        
+        @param   key:str  The key of the object
+        @return  :¿V?     The object, `None` if it is not in the store
+        '''
+        import pickle, zlib
+        try:
+            with open(self.path(key), 'rb') as file:
+                return pickle.loads(zlib.decompress(file.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError):
+            return None
+    
+    
+    def prune(self, keep):
+        '''
+        Remove all objects in the directory of this instance except those that
+        are still referenced, and the directories of instances that have exited
+        
+        Directories that are locked, or are still being created, are not removed
+        
+        @param  keep:itr<str>  The keys of the objects to keep
+        '''
+        import fcntl, shutil
+        keep = set(keep)
+        try:
+            keys = os.listdir(self.directory)
+        except FileNotFoundError:
+            keys = []
+        for key in keys:
+            if key not in keep and not key == 'lock' and not key.endswith('~'):
+                try:
+                    os.unlink(self.path(key))
+                except OSError:
+                    pass
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+        for name in names:
+            directory = os.path.join(self.root, name)
+            if name == self.name or name.endswith('~') or not os.path.isdir(directory):
+                continue
+            try:
+                with open(os.path.join(directory, 'lock'), 'rb') as lock_file:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    shutil.rmtree(directory, ignore_errors = True)
+            except OSError:
+                # Locked by a running instance, or already removed
+                pass
@@ -107,17 +107,53 @@ def set_tty_settings(echo = None, isig = None, icanon = None, ixany = None, ixof
     termios.tcsetattr(sys.stdout.fileno(), termios.TCSAFLUSH, stty)
 
 
+_winch_pipe = None
+'''
+:(int, int)?  The read end and the write end of the pipe written to when the terminal changes size
+'''
+
+
 def set_up_winch_listener(callback):
     '''
     Select function to be called when the terminal change size
     
-    @param  callback:()→void  The function to call when the terminal change size
+    Because system calls are restarted after signals, waiting for input
+    is not interrupted when the terminal changes size. Therefore a byte
+    is also written to a pipe, the returned file descriptor, which can
+    be waited for together with the terminal
+    
+    @param   callback:()→void  The function to call when the terminal change size
+    @return  :int              File descriptor that becomes readable when the terminal
+                               changes size, use `clear_wakeup_fd` to reset it
     '''
+    global _winch_pipe
     import signal
+    if _winch_pipe is None:
+        _winch_pipe = os.pipe()
+        for fd in _winch_pipe:
+            os.set_blocking(fd, False)
     def proxy_callback(sig, _stack):
         signal.signal(sig, proxy_callback)
+        try:
+            os.write(_winch_pipe[1], b'\0')
+        except BlockingIOError:
+            pass
         callback()
     signal.signal(signal.SIGWINCH, proxy_callback)
+    return _winch_pipe[0]
+
+
+def clear_wakeup_fd(fd):
+    '''
+    Discard everything that has been written to a non-blocking wakeup pipe
+    
+    @param  fd:int  The read end of the pipe
+    '''
+    try:
+        while len(os.read(fd, 4096)) > 0:
+            pass
+    except BlockingIOError:
+        pass
 
 
 def get_terminal_size():
@@ -138,7 +174,7 @@ def read_terminal_input():
     
     @return  :str?  The input unit, `None` if interrupted
     '''
-    rc, buffer, utf8n, utf8c, esc = '', [], 0, 0, False
+    rc, buffer, utf8n, utf8c, esc = '', [], 0, 0, None
     try:
         while True:
             if len(_terminal_input_buffer) == 0:
@@ -164,7 +200,8 @@ def read_terminal_input():
                 continue
             else:
                 c = chr(c)
-            if esc > 0:
+            if esc is not None:
+                # esc is 0 directly after ESC, and 1 inside CSI or SS3
                 rc += c
                 if esc == 0:
                     if c in '[O':
@@ -172,7 +209,6 @@ def read_terminal_input():
                     else:
                         break
                 elif c not in '1234567890;':
-                    esc = 0
                     break
             elif c == '\033':
                 rc += c
@@ -186,6 +222,25 @@ def read_terminal_input():
     return rc
 
 
+def wait_for_terminal_input(fds = [], timeout = None):
+    '''
+    Wait until there is input from the terminal or another file descriptor is readable
+    
+    @param   fds:list<int>   Other file descriptors to wait for
+    @param   timeout:float?  The maximum number of seconds to wait, `None` for no limit
+    @return  :list<int>?     The file descriptors in `fds` that are readable, empty if
+                             there is input from the terminal and nothing else is readable,
+                             `None` if the timeout expired
+    '''
+    import select
+    if len(_terminal_input_buffer) > 0:
+        return []
+    ready = select.select([_terminal_input_fileno] + fds, [], [], timeout)[0]
+    if len(ready) == 0:
+        return None
+    return [fd for fd in ready if fd in fds]
+
+
 def ctrl(key):
     '''
     Get the character sequence for a key combined with the control modifier